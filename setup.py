@@ -48,7 +48,8 @@ tests_require = [
 extras_require = {
     'docs': docs_require,
     'dev': dev_env_require,
-    'tests': tests_require
+    'tests': tests_require,
+    'numba': ['numba>=0.57']
 }
 
 extras_require['all'] = [req for _, reqs in extras_require.items() for req in reqs]
@@ -58,10 +59,15 @@ setup_requires = [
 ]
 
 install_requires = [
+    'aiohttp>=3.8',
     'numpy!=1.24.0,<2,>=1.22',
     'matplotlib>=3.7',
     'seaborn>=0.13.2',
     'pandas>=2',
+    'cachetools>=5.0',
+    'orjson>=3.8',
+    'ijson>=3.1',
+    'requests-cache>=1.0',
     'jsonschema>=3.2',
     'pystac-client>=0.8.3',
     'kaleido<1.0.0',
@@ -177,6 +177,12 @@ class WCPMS:
             text=self.tr(u''),
             callback=self.run,
             parent=self.iface.mainWindow())
+        self.add_action(
+            icon_path,
+            text=self.tr(u'Clear WCPMS cache'),
+            callback=self.clearCache,
+            add_to_toolbar=False,
+            parent=self.iface.mainWindow())
         # will be set False in run()
         self.first_start = True
 
@@ -188,6 +194,10 @@ class WCPMS:
                 action)
             self.iface.removeToolBarIcon(action)
 
+    def clearCache(self):
+        """Remove the cached responses from WCPMS server."""
+        WCPMS_Controls.clearCache()
+
     def showHelp(self):
         """Open html doc on default browser."""
         helpfile = (
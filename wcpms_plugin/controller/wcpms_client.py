@@ -18,24 +18,83 @@
 
 """Python Client Library for Web Crop Phenology Metrics Service"""
 
+import asyncio
+import copy
+import gzip
 import json
 import os
-import urllib
 import warnings
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
 from datetime import datetime as dt
 from datetime import timedelta
 
+import aiohttp
 import geopandas as gpd
+import ijson
 import matplotlib.dates as mdates
 import matplotlib.pyplot as plt
-import pandas as pd
+import numpy as np
+import orjson
 import plotly.graph_objects as go
-import requests
+import requests_cache
 import seaborn as sns
-from scipy.signal import savgol_filter
+from cachetools import TTLCache, cached
+from requests.adapters import HTTPAdapter
+from scipy.ndimage import convolve1d
+from scipy.signal import savgol_coeffs, savgol_filter
+from urllib3.util.retry import Retry
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
 
 warnings.filterwarnings("ignore")
 
+#: requests_cache.CachedSession: HTTP session shared by every WCPMS call.
+#: Responses (including POST bodies) are cached on disk for 12 hours.
+_SESSION = requests_cache.CachedSession(
+    'wcpms_cache',
+    backend='sqlite',
+    use_cache_dir=True,
+    expire_after=timedelta(hours=12),
+    allowable_methods=('GET', 'POST'),
+    match_headers=False,
+    cache_control=False
+)
+
+#: requests.adapters.HTTPAdapter: Keep-alive connection pool with retries on gateway errors.
+#: When the retries are exhausted the last gateway error response is returned as is.
+_ADAPTER = HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=20,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=[502, 503, 504],
+        allowed_methods=frozenset(['GET', 'POST']),
+        raise_on_status=False
+    )
+)
+_SESSION.mount('http://', _ADAPTER)
+_SESSION.mount('https://', _ADAPTER)
+
+#: tuple: Connect and read timeouts, in seconds, for every WCPMS request.
+_TIMEOUT = (5, 60)
+
+def _get(url, **kwargs):
+    """Send a GET request through the shared session, with the default timeout unless ``timeout`` is given."""
+    kwargs.setdefault('timeout', _TIMEOUT)
+    return _SESSION.get(url, **kwargs)
+
+def _post(url, **kwargs):
+    """Send a POST request through the shared session, with the default timeout unless ``timeout`` is given."""
+    kwargs.setdefault('timeout', _TIMEOUT)
+    return _SESSION.post(url, **kwargs)
+
 class WCPMS:
     """Implement a client for WCPMS.
 
@@ -58,6 +117,39 @@ class WCPMS:
         #: str: Authentication token to be used with the WCPMS server.
         self._access_token = access_token
 
+#: cachetools.TTLCache: In-memory cache for the list of data cubes, valid for 1 hour.
+_COLLECTIONS_CACHE = TTLCache(maxsize=8, ttl=3600)
+
+#: cachetools.TTLCache: In-memory cache for the description of the phenological metrics, valid for 1 hour.
+_DESCRIPTION_CACHE = TTLCache(maxsize=8, ttl=3600)
+
+#: cachetools.TTLCache: In-memory cache for the phenometrics of single locations, valid for 12 hours as the local cache.
+_PHENOMETRICS_CACHE = TTLCache(maxsize=1024, ttl=12 * 3600)
+
+#: dict: Headers for the json documents sent as request body.
+_JSON_HEADERS = {'Content-Type': 'application/json'}
+
+#: dict: Headers for json requests whose response bypasses the local cache, both on read and write.
+_NO_STORE_JSON_HEADERS = {**_JSON_HEADERS, 'Cache-Control': 'no-store'}
+
+#: dict: Headers for the gzip compressed json documents sent as request body.
+_GZIP_JSON_HEADERS = {**_JSON_HEADERS, 'Content-Encoding': 'gzip'}
+
+#: int: Maximum number of simultaneous connections for concurrent requests.
+_MAX_CONNECTIONS = 16
+
+def _phenometrics_query(cube, latitude, longitude):
+    """Build the query parameters of the phenometrics endpoint for a single location."""
+    return dict(
+        collection=cube['collection'],
+        band=cube['band'],
+        start_date=cube['start_date'],
+        end_date=cube['end_date'],
+        freq=cube['freq'],
+        latitude=latitude,
+        longitude=longitude,
+    )
+
 def get_phenometrics(url, cube, latitude, longitude):
     """Returns in dictionary form all the phenological metrics calculated for the given spatial location, as well as the time series and timeline used.
 
@@ -112,22 +204,207 @@ def get_phenometrics(url, cube, latitude, longitude):
              'vos_v': 4817.33349609375
             }
     """
-    query = dict(
+    return copy.deepcopy(_get_phenometrics_cached(url, _freeze(cube), latitude, longitude))
+
+def _freeze(d):
+    """Return a hashable version of a flat dictionary."""
+    return tuple(sorted(d.items()))
+
+@cached(_PHENOMETRICS_CACHE)
+def _get_phenometrics_cached(url, cube_frozen, latitude, longitude):
+    """Retrieve the phenometrics for a single location, remembering the result as long as the local cache.
+
+    The remembered result is shared, callers must not change it.
+    """
+    query = _phenometrics_query(dict(cube_frozen), latitude, longitude)
+
+    data = _get(url + '/phenometrics', params = query)
+    data_json = orjson.loads(data.content)
+
+    return data_json['result']
+
+def get_phenometrics_batch(url, cube, points):
+    """Returns the phenological metrics for a list of spatial locations using a single request.
+
+    Args:
+        url: The url of the available wcpms service running
+
+        cube : Dictionary with information about a BDC's data cubes with collection, start_date, end_date, freq and band.
+
+        points : A list of (latitude, longitude) pairs according to EPSG:4326.
+
+    Returns:
+    list: A list of dictionaries with phenological metrics and time series, in the same order of ``points``.
+
+
+    Raises:
+        ConnectionError: If the server is not reachable.
+        HTTPError: If the server response indicates an error.
+        ValueError: If the response body is not a json document.
+    """
+    body = dict(
         collection=cube['collection'],
         band=cube['band'],
         start_date=cube['start_date'],
         end_date=cube['end_date'],
         freq=cube['freq'],
-        latitude=latitude,
-        longitude=longitude,
+        points=[dict(lat=latitude, lon=longitude) for latitude, longitude in points]
     )
 
-    url_suffix = '/phenometrics?'+urllib.parse.urlencode(query)
+    url_suffix = '/phenometrics'
 
-    data = requests.get(url + url_suffix)
-    data_json = data.json()
+    data = _post(url + url_suffix, data = orjson.dumps(body, option=orjson.OPT_SERIALIZE_NUMPY), headers = _JSON_HEADERS)
+    data_json = orjson.loads(data.content)
 
-    return data_json['result']
+    return list(data_json['result'])
+
+async def _aget(session, url, **kwargs):
+    """Send an asynchronous GET request and decode the json response."""
+    async with session.get(url, **kwargs) as response:
+        return await response.json(loads=orjson.loads, content_type=None)
+
+async def _apost(session, url, **kwargs):
+    """Send an asynchronous POST request and decode the json response."""
+    async with session.post(url, **kwargs) as response:
+        return await response.json(loads=orjson.loads, content_type=None)
+
+def _json_serialize(obj):
+    """Encode the json body of an asynchronous request with orjson."""
+    return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+
+def _run(coroutine):
+    """Run a coroutine until it completes, blocking the caller, even when an event loop is already running."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
+
+async def get_phenometrics_many(url, cube, coords):
+    """Retrieve the phenological metrics for several spatial locations using concurrent requests.
+
+    Args:
+        url: The url of the available wcpms service running
+
+        cube : Dictionary with information about a BDC's data cubes with collection, start_date, end_date, freq and band.
+
+        coords : A list of (latitude, longitude) pairs according to EPSG:4326.
+
+    Returns:
+    list: A list of dictionaries with phenological metrics and time series, in the same order of ``coords``.
+
+    .. note::
+
+        The concurrent requests use their own ``aiohttp`` session, so they bypass the local cache and the retry policy of the other WCPMS requests.
+    """
+    connector = aiohttp.TCPConnector(limit=_MAX_CONNECTIONS)
+    timeout = aiohttp.ClientTimeout(sock_connect=_TIMEOUT[0], sock_read=_TIMEOUT[1])
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout, json_serialize=_json_serialize) as session:
+        responses = await asyncio.gather(*[
+            _aget(session, url + '/phenometrics', params=_phenometrics_query(cube, latitude, longitude))
+            for latitude, longitude in coords
+        ])
+    return [data_json['result'] for data_json in responses]
+
+async def get_timeseries_region_many(url, cube, geoms):
+    """Retrieve the time series of several regions (e.g. tiles of a large area) using concurrent requests.
+
+    Args:
+        url: The url of the available wcpms service running.
+
+        cube : Dictionary with information about a BDC's data cubes with collection, start_date, end_date, freq and band.
+
+        geoms : A list of GeoJSON geometries, according to EPSG:4326.
+
+    Returns:
+    list: A list with the time series of each pixel for every geometry, in the same order of ``geoms``.
+
+    .. note::
+
+        The concurrent requests use their own ``aiohttp`` session, so they bypass the local cache and the retry policy of the other WCPMS requests.
+    """
+    connector = aiohttp.TCPConnector(limit=_MAX_CONNECTIONS)
+    timeout = aiohttp.ClientTimeout(sock_connect=_TIMEOUT[0], sock_read=_TIMEOUT[1])
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout, json_serialize=_json_serialize) as session:
+        responses = await asyncio.gather(*[
+            _apost(session, url + '/timeseries', json=dict(
+                collection=cube['collection'],
+                band=cube['band'],
+                start_date=cube['start_date'],
+                end_date=cube['end_date'],
+                freq=cube['freq'],
+                geom=geom
+            ))
+            for geom in geoms
+        ])
+    return [data_json['result'] for data_json in responses]
+
+def run_many(url, cube, coords):
+    """Blocking version of :func:`get_phenometrics_many`.
+
+    .. note::
+
+        The call returns only when every request has finished. QGIS does not run an asyncio event loop,
+        so calling it from the UI thread freezes QGIS until then; run it from a ``QgsTask`` to keep the UI responsive.
+        As in :func:`get_phenometrics_many`, the requests bypass the local cache and the retry policy.
+    """
+    return _run(get_phenometrics_many(url, cube, coords))
+
+def run_timeseries_region_many(url, cube, geoms):
+    """Blocking version of :func:`get_timeseries_region_many`, see the note of :func:`run_many`."""
+    return _run(get_timeseries_region_many(url, cube, geoms))
+
+class PhenometricsBatch:
+    """Accumulate spatial locations to retrieve their phenological metrics in a single request.
+
+    .. note::
+
+        Use it through :func:`phenometrics_batch`, the request is sent when the ``with`` block ends.
+    """
+
+    def __init__(self, url, cube):
+        """Create a batch of locations for the given data cube.
+
+        Args:
+            url (str): URL for the WCPMS server.
+            cube (dict): Dictionary with information about a BDC's data cubes.
+        """
+        self._url = url
+        self._cube = cube
+
+        #: list: Pending (latitude, longitude) pairs.
+        self.points = []
+
+        #: list: Phenological metrics for each point, available after flush.
+        self.results = None
+
+    def add(self, latitude, longitude):
+        """Append a location to the batch and return its index in ``results``."""
+        self.points.append((latitude, longitude))
+        return len(self.points) - 1
+
+    def flush(self):
+        """Send all pending locations in a single request."""
+        self.results = get_phenometrics_batch(self._url, self._cube, self.points) if self.points else []
+        return self.results
+
+@contextmanager
+def phenometrics_batch(url, cube):
+    """Group several ``get_phenometrics`` queries into a single request.
+
+    Example:
+
+        .. code-block:: python
+
+            with phenometrics_batch(wcpms_url, datacube) as batch:
+                for latitude, longitude in locations:
+                    batch.add(latitude, longitude)
+            batch.results
+    """
+    batch = PhenometricsBatch(url, cube)
+    yield batch
+    batch.flush()
 
 def cube_query(collection, start_date, end_date, freq, band):
     """An object that contains the information associated with a collection that can be downloaded or acessed.
@@ -160,152 +437,306 @@ def cube_query(collection, start_date, end_date, freq, band):
         freq=freq
     )
 
-def smooth_timeseries(ts, method='savitsky', window_length=3, polyorder=1):
-    if (method=='savitsky'):
-        smooth_ts = savgol_filter(x=ts, window_length=window_length, polyorder=polyorder)
+def _sg_kernel(window_length, polyorder):
+    """Compute the Savitzky-Golay convolution coefficients and the polynomial fit matrices for both edges."""
+    halflen = window_length // 2
+    coeffs = savgol_coeffs(window_length, polyorder).astype(np.float64)
+    left = np.array([
+        savgol_coeffs(window_length, polyorder, pos=pos, use='dot')
+        for pos in range(halflen)
+    ]).reshape(-1, window_length)
+    right = np.array([
+        savgol_coeffs(window_length, polyorder, pos=pos, use='dot')
+        for pos in range(window_length - halflen, window_length)
+    ]).reshape(-1, window_length)
+    return coeffs, left, right
+
+#: dict: Savitzky-Golay kernels for the usual (window_length, polyorder) pairs, computed at import.
+#: Kernels of other pairs are added the first time they are used.
+_SG_TABLE = {
+    (window_length, polyorder): _sg_kernel(window_length, polyorder)
+    for window_length, polyorder in [(3, 1), (5, 2), (7, 2), (7, 3), (9, 2), (9, 3), (11, 3)]
+}
+
+def _sg_coeffs(window_length, polyorder):
+    """Return the Savitzky-Golay kernel from ``_SG_TABLE``, computing and storing it for pairs out of the table."""
+    kernel = _SG_TABLE.get((window_length, polyorder))
+    if kernel is None:
+        kernel = _SG_TABLE[window_length, polyorder] = _sg_kernel(window_length, polyorder)
+    return kernel
+
+def _savgol(x, window_length, polyorder):
+    """Apply the Savitzky-Golay filter along the last axis, same output as ``savgol_filter(mode='interp')``."""
+    if x.shape[-1] < window_length:
+        raise ValueError("window_length must be less than or equal to the size of the time series.")
+    coeffs, left, right = _sg_coeffs(window_length, polyorder)
+    smooth_ts = convolve1d(x, coeffs, axis=-1, mode='constant')
+    smooth_ts[..., :left.shape[0]] = x[..., :window_length] @ left.T
+    smooth_ts[..., x.shape[-1] - right.shape[0]:] = x[..., -window_length:] @ right.T
     return smooth_ts
 
-def plot_phenometrics(cube, ds_phenos):
+def smooth_timeseries(ts, method='savitsky', window_length=3, polyorder=1):
+    if (method!='savitsky'):
+        raise ValueError(f"Unknown smoothing method '{method}'.")
+    return _savgol(np.asarray(ts, dtype=np.float64), window_length, polyorder)
+
+def smooth_timeseries_batch(ts_2d, method='savitsky', window_length=3, polyorder=1):
+    """Smooth several time series of the same length at once, one time series per row."""
+    if (method!='savitsky'):
+        raise ValueError(f"Unknown smoothing method '{method}'.")
+    return _savgol(np.atleast_2d(np.asarray(ts_2d, dtype=np.float64)), window_length, polyorder)
+
+if njit is not None:
+    @njit(parallel=True, fastmath={'reassoc', 'contract'})
+    def _sg_apply(arr, coeffs, left, right, out):
+        """Savitzky-Golay filter of each row of ``arr`` into ``out``, using all the CPU cores."""
+        pixels, size = arr.shape
+        window_length = coeffs.size
+        halflen = window_length // 2
+        nleft = left.shape[0]
+        nright = right.shape[0]
+        for i in prange(pixels):
+            for t in range(nleft):
+                acc = 0.0
+                for j in range(window_length):
+                    acc += left[t, j] * arr[i, j]
+                out[i, t] = acc
+            for t in range(nleft, size - nright):
+                acc = 0.0
+                for j in range(window_length):
+                    acc += arr[i, t + halflen - j] * coeffs[j]
+                out[i, t] = acc
+            for t in range(nright):
+                acc = 0.0
+                for j in range(window_length):
+                    acc += right[t, j] * arr[i, size - window_length + j]
+                out[i, size - nright + t] = acc
+
+def smooth_region(timeseries_list, w=3, p=1):
+    """Smooth the time series of every pixel in a region with a single Savitzky-Golay call.
 
-    y_new = smooth_timeseries(ts=ds_phenos['timeseries']['values'], method='savitsky', window_length=3)
+    Args:
+        timeseries_list : A list of dictionaries with the time series ``values`` of each pixel.
 
-    timeline = ds_phenos['timeseries']['timeline']
-    timeseries = ds_phenos['timeseries']['values']
-    phenometrics = ds_phenos['phenometrics']
+        w : The length of the filter window.
 
-    pos_t_minus = dt.strptime(phenometrics['pos_t'].split('T')[0], "%Y-%m-%d")
-    pos_t_plus = dt.strptime(phenometrics['pos_t'].split('T')[0], "%Y-%m-%d")
+        p : The order of the polynomial used to fit the samples.
 
-    pos_t_minus = pos_t_minus - timedelta(days=5)
-    pos_t_plus = pos_t_plus + timedelta(days=5)
+    Returns:
+    numpy.ndarray: A (pixels, timeline) ``float32`` array with the smoothed time series, one pixel per row.
+        Shorter time series are padded with their last value.
 
-    fig = go.Figure()
+    .. note::
 
-    fig.add_trace(go.Scatter(
-        name='LIOS',
-        mode="lines",
-        x=[phenometrics['sos_t'].split('T')[0], phenometrics['sos_t'].split('T')[0], phenometrics['pos_t'].split('T')[0], phenometrics['eos_t'].split('T')[0], phenometrics["eos_t"].split('T')[0]],
-        y=[0, phenometrics["sos_v"], phenometrics["pos_v"], phenometrics["eos_v"], 0],
-        fill='toself',
-        showlegend=False,
-        fillcolor='rgba(153, 247, 254, 0.4)',
-        line=dict(color= 'rgba(153, 247, 254, 0.4)')
-    ))
+        When `numba <https://numba.pydata.org/>`_ is installed the filter runs in parallel over the pixels.
+    """
+    values = [ts['values'] for ts in timeseries_list]
+    arr = np.empty((len(values), max(map(len, values), default=0)), dtype=np.float32)
+    for row, ts in zip(arr, values):
+        row[:len(ts)] = ts
+        row[len(ts):] = ts[-1] if len(ts) else np.nan
+    if njit is None:
+        return savgol_filter(arr, w, p, axis=1)
+    if arr.shape[1] < w:
+        raise ValueError("window_length must be less than or equal to the size of the time series.")
+    coeffs, left, right = (np.ascontiguousarray(k, dtype=np.float32) for k in _sg_coeffs(w, p))
+    smooth = np.empty_like(arr)
+    _sg_apply(arr, coeffs, left, right, smooth)
+    return smooth
+
+@dataclass
+class PlotData:
+    """A phenometrics result parsed and smoothed once, ready to be drawn by any plot backend."""
+
+    #: str: Attribute (band) name used in the legend.
+    band: str
+
+    #: numpy.ndarray: Timeline as ``datetime64[D]``.
+    timeline: np.ndarray
+
+    #: numpy.ndarray: Raw time series as ``float32``.
+    ts: np.ndarray
+
+    #: numpy.ndarray: Smoothed time series as ``float32``.
+    y_new: np.ndarray
+
+    #: numpy.datetime64: Start, peak, end and valley of season dates.
+    sos_t: np.datetime64
+    pos_t: np.datetime64
+    eos_t: np.datetime64
+    vos_t: np.datetime64
+
+    #: str: Start, peak, end and valley of season dates, following YYYY-MM-DD structure.
+    sos_d: str
+    pos_d: str
+    eos_d: str
+    vos_d: str
+
+    #: float: Start, peak, end and valley of season values.
+    sos_v: float
+    pos_v: float
+    eos_v: float
+    vos_v: float
+
+    #: list: Dates of the LIOS polygon.
+    lios_x: list
+
+    #: list: Values of the LIOS polygon.
+    lios_y: list
+
+def _plot_data(band, timeline, timeseries, phenometrics, size=None):
+    """Build the PlotData of a time series, keeping only the first ``size`` samples when given."""
+    ts = np.asarray(timeseries, dtype=np.float32)
+    y_new = smooth_timeseries(ts=ts, method='savitsky', window_length=3).astype(np.float32)
+
+    sos_d, pos_d, eos_d, vos_d = (phenometrics[k].split('T', 1)[0] for k in ('sos_t', 'pos_t', 'eos_t', 'vos_t'))
+    sos_t, pos_t, eos_t, vos_t = (np.datetime64(d, 'D') for d in (sos_d, pos_d, eos_d, vos_d))
+    sos_v, pos_v, eos_v, vos_v = (phenometrics[k] for k in ('sos_v', 'pos_v', 'eos_v', 'vos_v'))
+
+    return PlotData(
+        band=band,
+        timeline=np.array([t[:10] for t in timeline[:size]], dtype='datetime64[D]'),
+        ts=ts[:size],
+        y_new=y_new[:size],
+        sos_t=sos_t, pos_t=pos_t, eos_t=eos_t, vos_t=vos_t,
+        sos_d=sos_d, pos_d=pos_d, eos_d=eos_d, vos_d=vos_d,
+        sos_v=sos_v, pos_v=pos_v, eos_v=eos_v, vos_v=vos_v,
+        lios_x=[sos_t, sos_t, pos_t, eos_t, eos_t],
+        lios_y=[0, sos_v, pos_v, eos_v, 0]
+    )
 
-    fig.add_trace(go.Scatter(
-        name=cube['band'],
-        x=timeline,
-        y=timeseries,
-        line=dict(color='#17BECF')
-    ))
+#: collections.OrderedDict: Prepared plot data of the latest phenometrics results, keyed by ``id``.
+_PLOT_DATA_CACHE = OrderedDict()
 
-    fig.add_trace(go.Scatter(
-        name="Smooth " + cube['band'],
-        x=timeline,
-        y=y_new,
-        line=dict(color='#ff0000')
-    ))
+#: int: Maximum number of phenometrics results kept in ``_PLOT_DATA_CACHE``.
+_PLOT_DATA_CACHE_SIZE = 8
 
-    fig.add_trace(go.Scatter(
-        name='LOS',
-        mode="lines",
-        x=[phenometrics["sos_t"].split('T')[0], phenometrics["eos_t"].split('T')[0]],
-        y=[phenometrics["sos_v"], phenometrics["eos_v"]],
-        showlegend=False,
-        line=dict(color='#000000', dash='dashdot')
-    ))
+def _prepare(cube, ds_phenos):
+    """Return the PlotData of a phenometrics result, sharing it between the plot functions.
+
+    The cached entry keeps a reference to ``ds_phenos`` so its ``id`` can not be reused by another object.
+    """
+    key = id(ds_phenos)
+    cached = _PLOT_DATA_CACHE.get(key)
+    if cached is not None and cached[0] is ds_phenos and cached[1].band == cube['band']:
+        _PLOT_DATA_CACHE.move_to_end(key)
+        return cached[1]
+
+    data = _plot_data(
+        cube['band'],
+        ds_phenos['timeseries']['timeline'],
+        ds_phenos['timeseries']['values'],
+        ds_phenos['phenometrics']
+    )
 
-    fig.add_trace(go.Scatter(
+    _PLOT_DATA_CACHE[key] = (ds_phenos, data)
+    if len(_PLOT_DATA_CACHE) > _PLOT_DATA_CACHE_SIZE:
+        _PLOT_DATA_CACHE.popitem(last=False)
+    return data
+
+def _render_plotly(data, advanced=False):
+    """Draw the phenological metrics with plotly, adding the uncertainty of SOS and EOS when ``advanced``."""
+    markers = dict(
+        SOS=(data.sos_d, data.sos_v, '#008c00'),
+        POS=(data.pos_d, data.pos_v, '#0009e3'),
+        EOS=(data.eos_d, data.eos_v, '#8a6100'),
+        VOS=(data.vos_d, data.vos_v, '#e35400')
+    )
+
+    traces = [
+        go.Scatter(
+            name='LIOS',
+            mode="lines",
+            x=[data.sos_d, data.sos_d, data.pos_d, data.eos_d, data.eos_d],
+            y=data.lios_y,
+            fill='toself',
+            showlegend=False,
+            fillcolor='rgba(153, 247, 254, 0.4)',
+            line=dict(color= 'rgba(153, 247, 254, 0.4)')
+        ),
+        go.Scatter(
+            name=data.band,
+            x=data.timeline,
+            y=data.ts,
+            line=dict(color='#17BECF')
+        ),
+        go.Scatter(
+            name="Smooth " + data.band,
+            x=data.timeline,
+            y=data.y_new,
+            line=dict(color='#ff0000')
+        )
+    ]
+
+    if not advanced:
+        traces.append(go.Scatter(
+            name='LOS',
+            mode="lines",
+            x=[data.sos_d, data.eos_d],
+            y=[data.sos_v, data.eos_v],
+            showlegend=False,
+            line=dict(color='#000000', dash='dashdot')
+        ))
+
+    traces.append(go.Scatter(
         name='AOS',
         mode="lines",
-        x=[phenometrics["pos_t"].split('T')[0], phenometrics["pos_t"].split('T')[0]],
-        y=[phenometrics["pos_v"], 0],
+        x=[data.pos_d, data.pos_d],
+        y=[data.pos_v, 0],
         showlegend=False,
         line=dict(color='#000000', dash='dashdot')
     ))
 
-    fig.add_trace(go.Scatter(
-        name='SOS',
-        mode="markers",
-        x=[phenometrics['sos_t'].split('T')[0]],
-        y=[phenometrics['sos_v']],
-        marker=dict(color='#008c00', size=12, line=dict(color= '#000000', width= 2) )
-    ))
-
-    fig.add_trace(go.Scatter(
-        name='POS',
-        mode="markers",
-        x=[phenometrics["pos_t"].split('T')[0]],
-        y=[phenometrics["pos_v"]],
-        marker=dict(color='#0009e3', size=12, line=dict(color='#000000', width=2 ) )
-    ))
+    for name in (('SOS', 'POS', 'VOS', 'EOS') if advanced else ('SOS', 'POS', 'EOS', 'VOS')):
+        x, y, color = markers[name]
+        traces.append(go.Scatter(
+            name=name,
+            mode="markers",
+            x=[x],
+            y=[y],
+            marker=dict(color=color, size=12, line=dict(color='#000000', width=2 ) )
+        ))
 
-    fig.add_trace(go.Scatter(
-        name='EOS',
-        mode="markers",
-        x=[phenometrics["eos_t"].split('T')[0]],
-        y=[phenometrics["eos_v"]],
-        marker=dict(color='#8a6100', size=12, line=dict(color='#000000', width=2 ) )
-    ))
+    fig = go.Figure(data=traces)
 
-    fig.add_trace(go.Scatter(
-        name='VOS',
-        mode="markers",
-        x=[phenometrics["vos_t"].split('T')[0]],
-        y=[phenometrics["vos_v"]],
-        marker=dict(color='#e35400', size=12, line=dict(color='#000000', width=2 ) )
-    ))
+    if advanced:
+        for date in (data.sos_d, data.eos_d):
+            time = dt.strptime(date, "%Y-%m-%d")
+            fig.add_vrect(x0=time - timedelta(days=16), x1=time + timedelta(days=16),
+                      annotation_text="Uncertainty", annotation_position="top left", fillcolor="green", opacity=0.25, line_width=0)
 
     fig.show()
 
-def plot_phenometrics_matplotlib(cube, ds_phenos, layout = (12, 6), attr = {}):
-    y_new = smooth_timeseries(ts=ds_phenos['timeseries']['values'], method='savitsky', window_length=3)
-
-    timeline_str = ds_phenos['timeseries']['timeline']
-    timeline = [dt.strptime(t.split('T')[0], "%Y-%m-%d") for t in timeline_str]
-    timeseries = ds_phenos['timeseries']['values']
-    phenometrics = ds_phenos['phenometrics']
-
-    sos_t = dt.strptime(phenometrics['sos_t'].split('T')[0], "%Y-%m-%d")
-    pos_t = dt.strptime(phenometrics['pos_t'].split('T')[0], "%Y-%m-%d")
-    eos_t = dt.strptime(phenometrics['eos_t'].split('T')[0], "%Y-%m-%d")
-    vos_t = dt.strptime(phenometrics['vos_t'].split('T')[0], "%Y-%m-%d")
-
-    sos_v = phenometrics["sos_v"]
-    pos_v = phenometrics["pos_v"]
-    eos_v = phenometrics["eos_v"]
-    vos_v = phenometrics["vos_v"]
-
+def _render_mpl(data, layout, attr):
+    """Draw the phenological metrics with matplotlib."""
     fig, ax = plt.subplots(figsize = layout) # convert from pixels to inches
 
     # Fill LIOS region
-    lios_dates = [sos_t, sos_t, pos_t, eos_t, eos_t]
-    lios_values = [0, sos_v, pos_v, eos_v, 0]
-    ax.fill(lios_dates, lios_values, color='skyblue', alpha=0.4, label='LIOS')
+    ax.fill(data.lios_x, data.lios_y, color='skyblue', alpha=0.4, label='LIOS')
 
     # Raw time series
-    ax.plot(timeline, timeseries, label=cube['band'], color='#17BECF')
+    ax.plot(data.timeline, data.ts, label=data.band, color='#17BECF')
 
     # Smoothed time series
-    ax.plot(timeline, y_new, label=f"Smooth {cube['band']}", color='#ff0000')
+    ax.plot(data.timeline, data.y_new, label=f"Smooth {data.band}", color='#ff0000')
 
     # LOS line
-    ax.plot([sos_t, eos_t], [sos_v, eos_v], linestyle='dashdot', color='black', label='LOS')
+    ax.plot([data.sos_t, data.eos_t], [data.sos_v, data.eos_v], linestyle='dashdot', color='black', label='LOS')
 
     # AOS line (vertical)
-    ax.plot([pos_t, pos_t], [pos_v, 0], linestyle='dashdot', color='black', label='AOS')
+    ax.plot([data.pos_t, data.pos_t], [data.pos_v, 0], linestyle='dashdot', color='black', label='AOS')
 
     # SOS point
-    ax.plot(sos_t, sos_v, 'o', label='SOS', color='#008c00', markersize=10, markeredgecolor='black', markeredgewidth=2)
+    ax.plot(data.sos_t, data.sos_v, 'o', label='SOS', color='#008c00', markersize=10, markeredgecolor='black', markeredgewidth=2)
 
     # POS point
-    ax.plot(pos_t, pos_v, 'o', label='POS', color='#0009e3', markersize=10, markeredgecolor='black', markeredgewidth=2)
+    ax.plot(data.pos_t, data.pos_v, 'o', label='POS', color='#0009e3', markersize=10, markeredgecolor='black', markeredgewidth=2)
 
     # EOS point
-    ax.plot(eos_t, eos_v, 'o', label='EOS', color='#8a6100', markersize=10, markeredgecolor='black', markeredgewidth=2)
+    ax.plot(data.eos_t, data.eos_v, 'o', label='EOS', color='#8a6100', markersize=10, markeredgecolor='black', markeredgewidth=2)
 
     # VOS point
-    ax.plot(vos_t, vos_v, 'o', label='VOS', color='#e35400', markersize=10, markeredgecolor='black', markeredgewidth=2)
+    ax.plot(data.vos_t, data.vos_v, 'o', label='VOS', color='#e35400', markersize=10, markeredgecolor='black', markeredgewidth=2)
 
     # Format x-axis
     ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
@@ -323,60 +754,32 @@ def plot_phenometrics_matplotlib(cube, ds_phenos, layout = (12, 6), attr = {}):
     plt.tight_layout()
     plt.show()
 
-def plot_phenometrics_seaborn(cube, ds_phenos, layout=(12, 4), attr={}):
-    # Smooth time series
-    y_new = smooth_timeseries(ts=ds_phenos['timeseries']['values'], method='savitsky', window_length=3)
-
-    # Prepare timeline and values
-    timeline_str = ds_phenos['timeseries']['timeline']
-    timeline = [dt.strptime(t.split('T')[0], "%Y-%m-%d") for t in timeline_str]
-    timeseries = ds_phenos['timeseries']['values']
-    phenometrics = ds_phenos['phenometrics']
-
-    # Key phenology dates
-    sos_t = dt.strptime(phenometrics['sos_t'].split('T')[0], "%Y-%m-%d")
-    pos_t = dt.strptime(phenometrics['pos_t'].split('T')[0], "%Y-%m-%d")
-    eos_t = dt.strptime(phenometrics['eos_t'].split('T')[0], "%Y-%m-%d")
-    vos_t = dt.strptime(phenometrics['vos_t'].split('T')[0], "%Y-%m-%d")
-
-    sos_v = phenometrics["sos_v"]
-    pos_v = phenometrics["pos_v"]
-    eos_v = phenometrics["eos_v"]
-    vos_v = phenometrics["vos_v"]
-
-    # Prepare DataFrame for Seaborn
-    df = pd.DataFrame({
-        'Date': timeline,
-        'Raw': timeseries,
-        'Smoothed': y_new
-    })
-
+def _render_sns(data, layout, attr):
+    """Draw the phenological metrics with seaborn."""
     plt.figure(figsize=layout)
     ax = plt.gca()
 
     # Fill LIOS region (custom Matplotlib)
-    lios_dates = [sos_t, sos_t, pos_t, eos_t, eos_t]
-    lios_values = [0, sos_v, pos_v, eos_v, 0]
-    ax.fill(lios_dates, lios_values, color='skyblue', alpha=0.4, label='LIOS')
+    ax.fill(data.lios_x, data.lios_y, color='skyblue', alpha=0.4, label='LIOS')
 
     # Plot raw and smoothed lines
-    sns.lineplot(data=df, x='Date', y='Raw', label=cube['band'], ax=ax, color='#17BECF')
-    sns.lineplot(data=df, x='Date', y='Smoothed', label=f"Smooth {cube['band']}", ax=ax, color='#ff0000')
+    sns.lineplot(x=data.timeline, y=data.ts, label=data.band, ax=ax, color='#17BECF')
+    sns.lineplot(x=data.timeline, y=data.y_new, label=f"Smooth {data.band}", ax=ax, color='#ff0000')
 
     # LOS line
-    ax.plot([sos_t, eos_t], [sos_v, eos_v], linestyle='dashdot', color='black', label='LOS')
+    ax.plot([data.sos_t, data.eos_t], [data.sos_v, data.eos_v], linestyle='dashdot', color='black', label='LOS')
 
     # AOS line (vertical)
-    ax.plot([pos_t, pos_t], [0, pos_v], linestyle='dashdot', color='black', label='AOS')
+    ax.plot([data.pos_t, data.pos_t], [0, data.pos_v], linestyle='dashdot', color='black', label='AOS')
 
     # Plot phenology points (using Seaborn's scatter)
-    sns.scatterplot(x=[sos_t], y=[sos_v], ax=ax, label='SOS',
+    sns.scatterplot(x=[data.sos_t], y=[data.sos_v], ax=ax, label='SOS',
                     color='#008c00', s=100, edgecolor='black', zorder=5)
-    sns.scatterplot(x=[pos_t], y=[pos_v], ax=ax, label='POS',
+    sns.scatterplot(x=[data.pos_t], y=[data.pos_v], ax=ax, label='POS',
                     color='#0009e3', s=100, edgecolor='black', zorder=5)
-    sns.scatterplot(x=[eos_t], y=[eos_v], ax=ax, label='EOS',
+    sns.scatterplot(x=[data.eos_t], y=[data.eos_v], ax=ax, label='EOS',
                     color='#8a6100', s=100, edgecolor='black', zorder=5)
-    sns.scatterplot(x=[vos_t], y=[vos_v], ax=ax, label='VOS',
+    sns.scatterplot(x=[data.vos_t], y=[data.vos_v], ax=ax, label='VOS',
                     color='#e35400', s=100, edgecolor='black', zorder=5)
 
     # Formatting
@@ -396,100 +799,20 @@ def plot_phenometrics_seaborn(cube, ds_phenos, layout=(12, 4), attr={}):
     plt.tight_layout()
     plt.show()
 
-def plot_advanced_phenometrics(cube, ds_phenos):
-
-    y_new = smooth_timeseries(ts=ds_phenos['timeseries'], method='savitsky', window_length=3)
-
-    timeline = ds_phenos['timeline'][:21]
-    timeseries = ds_phenos['timeseries'][:21]
-    phenometrics = ds_phenos['phenometrics']
-
-    pos_t_minus = dt.strptime(phenometrics['pos_t'].split('T')[0], "%Y-%m-%d")
-    pos_t_plus = dt.strptime(phenometrics['pos_t'].split('T')[0], "%Y-%m-%d")
-
-    pos_t_minus = pos_t_minus - timedelta(days=5)
-    pos_t_plus = pos_t_plus + timedelta(days=5)
-
-    fig = go.Figure()
-
-    fig.add_trace(go.Scatter(
-        name='LIOS',
-        mode="lines",
-        x=[phenometrics['sos_t'].split('T')[0], phenometrics['sos_t'].split('T')[0], phenometrics['pos_t'].split('T')[0], phenometrics['eos_t'].split('T')[0], phenometrics["eos_t"].split('T')[0]],
-        y=[0, phenometrics["sos_v"], phenometrics["pos_v"], phenometrics["eos_v"], 0],
-        fill='toself',
-        showlegend=False,
-        fillcolor='rgba(153, 247, 254, 0.4)',
-        line=dict(color= 'rgba(153, 247, 254, 0.4)')
-    ))
-
-    fig.add_trace(go.Scatter(
-        name=cube['band'],
-        x=timeline,
-        y=timeseries,
-        line=dict(color='#17BECF')
-    ))
-
-    fig.add_trace(go.Scatter(
-        name="Smooth " + cube['band'],
-        x=timeline,
-        y=y_new,
-        line=dict(color='#ff0000')
-    ))
-
-    fig.add_trace(go.Scatter(
-        name='AOS',
-        mode="lines",
-        x=[phenometrics["pos_t"].split('T')[0], phenometrics["pos_t"].split('T')[0]],
-        y=[phenometrics["pos_v"], 0],
-        showlegend=False,
-        line=dict(color='#000000', dash='dashdot')
-    ))
-
-    fig.add_trace(go.Scatter(
-        name='SOS',
-        mode="markers",
-        x=[phenometrics['sos_t'].split('T')[0]],
-        y=[phenometrics['sos_v']],
-        marker=dict(color='#008c00', size=12, line=dict(color= '#000000', width= 2) )
-    ))
-
-    fig.add_trace(go.Scatter(
-        name='POS',
-        mode="markers",
-        x=[phenometrics["pos_t"].split('T')[0]],
-        y=[phenometrics["pos_v"]],
-        marker=dict(color='#0009e3', size=12, line=dict(color='#000000', width=2 ) )
-    ))
-
-
-    fig.add_trace(go.Scatter(
-        name='VOS',
-        mode="markers",
-        x=[phenometrics["vos_t"].split('T')[0]],
-        y=[phenometrics["vos_v"]],
-        marker=dict(color='#e35400', size=12, line=dict(color='#000000', width=2 ) )
-    ))
-
-    fig.add_trace(go.Scatter(
-        name='EOS',
-        mode="markers",
-        x=[phenometrics["eos_t"].split('T')[0]],
-        y=[phenometrics["eos_v"]],
-        marker=dict(color='#8a6100', size=12, line=dict(color='#000000', width=2 ) )
-    ))
-
-    sos_time = dt.strptime(phenometrics['sos_t'].split('T')[0], "%Y-%m-%d")
-    eos_time = dt.strptime(phenometrics['eos_t'].split('T')[0], "%Y-%m-%d")
+def plot_phenometrics(cube, ds_phenos):
+    return _render_plotly(_prepare(cube, ds_phenos))
 
-    fig.add_vrect(x0=sos_time - timedelta(days=16), x1=sos_time + timedelta(days=16),
-              annotation_text="Uncertainty", annotation_position="top left", fillcolor="green", opacity=0.25, line_width=0)
+def plot_phenometrics_matplotlib(cube, ds_phenos, layout = (12, 6), attr = {}):
+    return _render_mpl(_prepare(cube, ds_phenos), layout, attr)
 
-    fig.add_vrect(x0=eos_time - timedelta(days=16), x1=eos_time + timedelta(days=16),
-              annotation_text="Uncertainty", annotation_position="top left", fillcolor="green", opacity=0.25, line_width=0)
+def plot_phenometrics_seaborn(cube, ds_phenos, layout=(12, 4), attr={}):
+    return _render_sns(_prepare(cube, ds_phenos), layout, attr)
 
-    fig.show()
+def plot_advanced_phenometrics(cube, ds_phenos):
+    data = _plot_data(cube['band'], ds_phenos['timeline'], ds_phenos['timeseries'], ds_phenos['phenometrics'], size=21)
+    return _render_plotly(data, advanced=True)
 
+@cached(_COLLECTIONS_CACHE)
 def get_collections(url):
     """List available data cubes in the BDC's SpatioTemporal Asset Catalogs (STAC).
 
@@ -521,11 +844,12 @@ def get_collections(url):
     """
     url_suffix = '/list_collections'
 
-    data = requests.get(url + url_suffix)
-    data_json = data.json()
+    data = _get(url + url_suffix)
+    data_json = orjson.loads(data.content)
 
     return data_json['coverages']
 
+@cached(_DESCRIPTION_CACHE)
 def get_description(url):
     """List the information on each of the phenological metrics, such as code, name, description and method.
 
@@ -543,15 +867,21 @@ def get_description(url):
     """
     url_suffix = '/describe'
 
-    data = requests.get(url + url_suffix)
-    data_json = data.json()
+    data = _get(url + url_suffix)
+    data_json = orjson.loads(data.content)
 
-    html_table = '<tr>'+'<td><b>Code</b></td>'+'<td><b>Name</b></td>'+'<td><b>Description</b></td>'+'<td><b>Method</b></td>'+'<td><b>Value</b></td>'+'<td><b>Time</b></td>'+'</tr>'
+    return data_json['description']
 
-    for item in data_json['description']:
-        html_table+='<tr>'+'<td>'+item['Code']+'</td>'+'<td>'+item['Name']+'</td>'+'<td>'+item['Description']+'</td>'+'<td>'+item['Method']+'</td>'+'<td>'+str(item['Value'])+'</td>'+'<td>'+str(item['Time'])+'</td>'+'</tr>'
+def clear_catalog_cache():
+    """Remove the in-memory results of ``get_collections`` and ``get_description``."""
+    _COLLECTIONS_CACHE.clear()
+    _DESCRIPTION_CACHE.clear()
 
-    return data_json['description']
+def invalidate_cache():
+    """Remove all the WCPMS responses stored in the local cache."""
+    _SESSION.cache.clear()
+    _PHENOMETRICS_CACHE.clear()
+    clear_catalog_cache()
 
 def gpd_read_file(shapefile_dir):
     data = gpd.read_file(os.path.join(shapefile_dir))
@@ -560,15 +890,6 @@ def gpd_read_file(shapefile_dir):
 def gdf_to_geojson(df):
     return json.loads(df.to_json())["features"][0]['geometry']
 
-def plot_points_region(polygon, phenos):
-    x, y = [],[]
-    for p in phenos:
-        x.append(p["point"][0])
-        y.append(p["point"][1])
-    df = gpd.GeoSeries(polygon["geometry"])
-    fig = px.scatter(df, x=x, y=y)
-    fig.show()
-
 def get_timeseries_region(url, cube, geom):
     """Retrieves the satellite images time series for each pixel centers within the boundaries of the given region from the Brazil Data Cube catalog.
 
@@ -599,13 +920,64 @@ def get_timeseries_region(url, cube, geom):
 
     url_suffix = '/timeseries'
 
-    data = requests.post(url + url_suffix, json = body)
+    data = _post(url + url_suffix, data = orjson.dumps(body, option=orjson.OPT_SERIALIZE_NUMPY), headers = _JSON_HEADERS)
 
-    data_json = data.json()
+    data_json = orjson.loads(data.content)
 
     return data_json['result']
 
-def get_phenometrics_region(url, cube, timeseries):
+def iter_timeseries_region(url, cube, geom):
+    """Yield the satellite images time series of each pixel within the given region while the response is downloaded.
+
+    The streamed response is not stored in the local cache, so only one pixel is decoded in memory at a time.
+
+    Args:
+        url: The url of the available wcpms service running.
+
+        cube : Dictionary with information about a BDC's data cubes with collection, start_date, end_date, freq and band.
+
+        geom : GeoJSON containing the geometry used to retrive time series, according to EPSG:4326.
+
+    Yields:
+    dict: The satellite images time series for a pixel.
+
+
+    Raises:
+        ConnectionError: If the server is not reachable.
+        HTTPError: If the server response indicates an error.
+        ValueError: If the response body is not a json document.
+    """
+    body = dict(
+        collection=cube['collection'],
+        band=cube['band'],
+        start_date=cube['start_date'],
+        end_date=cube['end_date'],
+        freq=cube['freq'],
+        geom=geom
+    )
+
+    url_suffix = '/timeseries'
+
+    with _post(url + url_suffix, data = orjson.dumps(body, option=orjson.OPT_SERIALIZE_NUMPY), headers = _NO_STORE_JSON_HEADERS, stream = True) as data:
+        data.raw.decode_content = True
+        yield from ijson.items(data.raw, 'result.item', use_float=True)
+
+def _dumps_with_list(body, key, items):
+    """Serialize the dictionary ``body`` adding the iterable ``items`` as a list under ``key``.
+
+    Each item is serialized as soon as it is consumed, so the decoded items are never held together,
+    but the whole serialized body is kept in memory to be sent (and cached) as a single request.
+    """
+    chunks = [orjson.dumps({**body, key: []}, option=orjson.OPT_SERIALIZE_NUMPY)[:-2]]
+    for item in items:
+        chunks.append(orjson.dumps(item, option=orjson.OPT_SERIALIZE_NUMPY))
+        chunks.append(b',')
+    if len(chunks) > 1:
+        chunks.pop()
+    chunks.append(b']}')
+    return b''.join(chunks)
+
+def get_phenometrics_region(url, cube, timeseries, compress=False):
     """List phenological metrics calculated for each spatial location within the boundaries of the given region.
 
     Args:
@@ -613,7 +985,10 @@ def get_phenometrics_region(url, cube, timeseries):
 
         cube : Dictionary with information about a BDC's data cubes with collection, start_date, end_date, freq and band.
 
-        timeseries : JSON containing a list of dictionaries with satellite images time series for each pixel.
+        timeseries : JSON containing a list (or any iterable, e.g. :func:`iter_timeseries_region`) of dictionaries with satellite images time series for each pixel.
+            The pixels of an iterable are serialized one at a time, but the whole serialized request body is held in memory.
+
+        compress : Send the request body compressed with gzip. The server must accept ``Content-Encoding: gzip`` bodies.
 
     Returns:
     list: A list of dictionaries with phenological metrics calculated for each pixel centers.
@@ -629,22 +1004,24 @@ def get_phenometrics_region(url, cube, timeseries):
         band=cube['band'],
         start_date=cube['start_date'],
         end_date=cube['end_date'],
-        freq=cube['freq'],
-        timeseries=timeseries
+        freq=cube['freq']
     )
 
     url_suffix = '/phenometrics'
 
-    data = requests.post(url + url_suffix, json = body)
-    data_json = data.json()
+    payload = _dumps_with_list(body, 'timeseries', timeseries)
+
+    if compress:
+        data = _post(url + url_suffix, data = gzip.compress(payload, compresslevel=3, mtime=0), headers = _GZIP_JSON_HEADERS)
+    else:
+        data = _post(url + url_suffix, data = payload, headers = _JSON_HEADERS)
+    data_json = orjson.loads(data.content)
 
     return data_json['result']
 
 def plot_points_region(polygon, phenos):
-    x, y = [],[]
-    for p in phenos:
-        x.append(p["point"][0])
-        y.append(p["point"][1])
+    points = np.array([p["point"] for p in phenos], dtype=np.float64).reshape(-1, 2)
+    x, y = points[:, 0], points[:, 1]
     df = gpd.GeoSeries(polygon["geometry"])
     geo_axes = df.plot()
     geo_axes.scatter(x, y, c='red')
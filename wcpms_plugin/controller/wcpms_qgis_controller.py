@@ -32,8 +32,8 @@ from PyQt5.QtWidgets import QMessageBox
 from wtss import *
 
 from ..config import Config
-from .wcpms_client import (cube_query, get_phenometrics, plot_phenometrics,
-                           plot_phenometrics_matplotlib,
+from .wcpms_client import (cube_query, get_phenometrics, invalidate_cache,
+                           plot_phenometrics, plot_phenometrics_matplotlib,
                            plot_phenometrics_seaborn)
 
 
@@ -98,6 +98,11 @@ class WCPMS_Controls:
         """Return a dictionary with product description."""
         return self.wtss[product]
 
+    @staticmethod
+    def clearCache():
+        """Remove the cached responses from WCPMS server."""
+        invalidate_cache()
+
     def getPhenometricsPlot(self, collection, collection_title, band, start_date, end_date, freq, longitude, latitude, opt = "seaborn"):
         if opt == "browser":
             request_url = (
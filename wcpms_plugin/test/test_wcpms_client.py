@@ -0,0 +1,362 @@
+# coding=utf-8
+"""WCPMS client test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__copyright__ = 'Copyright 2025, INPE'
+
+import gzip
+import importlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import requests
+from scipy.signal import savgol_filter
+
+#: str: Directory of the WCPMS client module.
+CONTROLLER_DIR = os.path.join(os.path.dirname(__file__), os.pardir, 'controller')
+
+wcpms_client = None
+_environ = {}
+
+
+def setUpModule():
+    """Import the client keeping its requests cache away from the user cache directory."""
+    global wcpms_client
+    _environ['XDG_CACHE_HOME'] = os.environ.get('XDG_CACHE_HOME')
+    _environ['cache_dir'] = os.environ['XDG_CACHE_HOME'] = tempfile.mkdtemp(prefix='wcpms_test_')
+    sys.path.insert(0, CONTROLLER_DIR)
+    wcpms_client = importlib.import_module('wcpms_client')
+
+
+def tearDownModule():
+    """Restore the environment and remove the requests cache of the tests."""
+    wcpms_client._SESSION.close()
+    sys.modules.pop('wcpms_client', None)
+    sys.path.remove(CONTROLLER_DIR)
+    if _environ['XDG_CACHE_HOME'] is None:
+        del os.environ['XDG_CACHE_HOME']
+    else:
+        os.environ['XDG_CACHE_HOME'] = _environ['XDG_CACHE_HOME']
+    shutil.rmtree(_environ['cache_dir'], ignore_errors=True)
+
+
+class SmoothTimeseriesTest(unittest.TestCase):
+    """Test the Savitzky-Golay smoothing matches scipy."""
+
+    WINDOWS = [(1, 0), (3, 1), (4, 2), (5, 2), (6, 3), (7, 3), (8, 2), (11, 3)]
+
+    def setUp(self):
+        """Runs before each test."""
+        self.rng = np.random.default_rng(0)
+
+    def test_smooth_timeseries_parity(self):
+        """Test 1-D smoothing for odd and even windows."""
+        for window_length, polyorder in self.WINDOWS:
+            for size in (window_length, window_length + 1, 23):
+                ts = self.rng.normal(size=size) * 1e3
+                np.testing.assert_allclose(
+                    wcpms_client.smooth_timeseries(list(ts), window_length=window_length, polyorder=polyorder),
+                    savgol_filter(ts, window_length, polyorder),
+                    rtol=1e-7, atol=1e-6
+                )
+
+    def test_smooth_timeseries_batch_parity(self):
+        """Test 2-D smoothing for odd and even windows."""
+        for window_length, polyorder in self.WINDOWS:
+            ts = self.rng.normal(size=(5, 23)) * 1e3
+            np.testing.assert_allclose(
+                wcpms_client.smooth_timeseries_batch(ts, window_length=window_length, polyorder=polyorder),
+                savgol_filter(ts, window_length, polyorder, axis=-1),
+                rtol=1e-7, atol=1e-6
+            )
+
+    def test_smooth_region_parity(self):
+        """Test region smoothing matches scipy, leaving empty time series as NaN."""
+        for window_length, polyorder in self.WINDOWS:
+            ts = self.rng.normal(size=(5, 23)) * 1e3
+            smooth = wcpms_client.smooth_region(
+                [dict(values=list(row)) for row in ts] + [dict(values=[])], window_length, polyorder
+            )
+            np.testing.assert_allclose(
+                smooth[:-1], savgol_filter(ts.astype(np.float32), window_length, polyorder, axis=-1),
+                rtol=1e-4, atol=1e-2
+            )
+            self.assertTrue(np.isnan(smooth[-1]).all())
+
+    def test_unknown_method(self):
+        """Test an unknown smoothing method raises ValueError."""
+        with self.assertRaises(ValueError):
+            wcpms_client.smooth_timeseries([1.0, 2.0, 3.0], method='unknown')
+        with self.assertRaises(ValueError):
+            wcpms_client.smooth_timeseries_batch([[1.0, 2.0, 3.0]], method='unknown')
+
+
+class WCPMSHandler(BaseHTTPRequestHandler):
+    """Reply the WCPMS endpoints used by the client, recording the requests received."""
+
+    PIXELS = 2000
+
+    def log_message(self, *args):
+        """Silence the request log."""
+
+    def _send(self, body):
+        """Send a json response in chunks, pausing between them until ``resume`` is set."""
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(sum(map(len, body))))
+        self.end_headers()
+        for chunk in body[:-1]:
+            self.wfile.write(chunk)
+            self.server.resume.wait(5)
+        self.server.finished.set()
+        self.wfile.write(body[-1])
+
+    def do_GET(self):
+        """Reply a GET request according to its path, after ``delay`` seconds and with ``status`` as error."""
+        self.server.requests.append((self.command, self.path, b''))
+        time.sleep(self.server.delay)
+        try:
+            if self.server.status != 200:
+                self.send_error(self.server.status)
+            elif self.path == '/list_collections':
+                self._send([json.dumps({'coverages': ['S2-16D-2']}).encode()])
+            elif self.path == '/describe':
+                self._send([json.dumps({'description': [{'code': 'SOS'}]}).encode()])
+            elif urlsplit(self.path).path == '/phenometrics':
+                query = parse_qs(urlsplit(self.path).query)
+                self._send([json.dumps({'result': {
+                    'point': [float(query['latitude'][0]), float(query['longitude'][0])],
+                    'timeseries': {'values': [float(v) for v in range(23)]}
+                }}).encode()])
+        except BrokenPipeError:
+            pass
+
+    def do_POST(self):
+        """Reply a POST request according to its path."""
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests.append((self.command, self.path, body))
+        if self.path == '/timeseries':
+            doc = json.dumps({'result': [
+                {'point': [i, i], 'values': [float(v) for v in range(23)]}
+                for i in range(self.PIXELS)
+            ]}).encode()
+            self._send([doc[:len(doc) // 2], doc[len(doc) // 2:]])
+        elif self.path == '/phenometrics':
+            if self.headers.get('Content-Encoding') == 'gzip':
+                body = gzip.decompress(body)
+            doc = json.loads(body)
+            if 'points' in doc:
+                result = [dict(point=[p['lat'], p['lon']]) for p in doc['points']]
+            else:
+                result = [dict(point=ts['point']) for ts in doc['timeseries']]
+            self._send([json.dumps({'result': result}).encode()])
+
+
+class WCPMSServerTestCase(unittest.TestCase):
+    """Run a local WCPMS stub server for each test."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), WCPMSHandler)
+        self.server.requests = []
+        self.server.resume = threading.Event()
+        self.server.resume.set()
+        self.server.finished = threading.Event()
+        self.server.delay = 0
+        self.server.status = 200
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+        self.cube = wcpms_client.cube_query('S2-16D-2', '2021-01-01', '2021-12-31', '16D', 'NDVI')
+        wcpms_client.invalidate_cache()
+
+    def tearDown(self):
+        """Runs after each test."""
+        self.server.resume.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class IterTimeseriesRegionTest(WCPMSServerTestCase):
+    """Test the region time series are streamed without the local cache."""
+
+    GEOM = {'type': 'Point', 'coordinates': [0, 0]}
+
+    def test_stream(self):
+        """Test the first pixel is yielded before the server finishes sending the response."""
+        self.server.resume.clear()
+        pixels = wcpms_client.iter_timeseries_region(self.url, self.cube, self.GEOM)
+        self.assertEqual(next(pixels)['point'], [0, 0])
+        self.assertFalse(self.server.finished.is_set())
+        self.server.resume.set()
+        self.assertEqual(len(list(pixels)), WCPMSHandler.PIXELS - 1)
+
+    def test_not_cached(self):
+        """Test every streamed request reaches the server."""
+        for _ in range(2):
+            self.assertEqual(
+                len(list(wcpms_client.iter_timeseries_region(self.url, self.cube, self.GEOM))), WCPMSHandler.PIXELS
+            )
+        self.assertEqual(len(self.server.requests), 2)
+
+
+class PhenometricsRegionTest(WCPMSServerTestCase):
+    """Test the region phenometrics requests."""
+
+    TIMESERIES = [dict(point=[i, i], values=[float(v) for v in range(23)]) for i in range(10)]
+
+    def test_compress_cached(self):
+        """Test the same compressed request sent a second later is replied from the cache."""
+        phenos = wcpms_client.get_phenometrics_region(self.url, self.cube, self.TIMESERIES, compress=True)
+        time.sleep(1)
+        self.assertEqual(
+            wcpms_client.get_phenometrics_region(self.url, self.cube, self.TIMESERIES, compress=True), phenos
+        )
+        self.assertEqual([p['point'] for p in phenos], [ts['point'] for ts in self.TIMESERIES])
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_streamed_timeseries(self):
+        """Test the time series streamed from the server are sent back in the same order."""
+        pixels = wcpms_client.iter_timeseries_region(self.url, self.cube, {'type': 'Point', 'coordinates': [0, 0]})
+        phenos = wcpms_client.get_phenometrics_region(self.url, self.cube, pixels)
+        self.assertEqual([p['point'] for p in phenos], [[i, i] for i in range(WCPMSHandler.PIXELS)])
+        self.assertEqual(len(json.loads(self.server.requests[1][2])['timeseries']), WCPMSHandler.PIXELS)
+
+
+class NumpyPayloadTest(WCPMSServerTestCase):
+    """Test request bodies built from numpy values."""
+
+    def test_phenometrics_batch(self):
+        """Test points given as a numpy array."""
+        points = np.array([[-29.2, -55.95], [-12.5, -45.0]])
+        phenos = wcpms_client.get_phenometrics_batch(self.url, self.cube, points)
+        self.assertEqual([p['point'] for p in phenos], points.tolist())
+
+    def test_phenometrics_region(self):
+        """Test time series values given as numpy arrays."""
+        timeseries = [dict(point=np.array([i, i]), values=np.arange(23, dtype=np.float32)) for i in range(3)]
+        phenos = wcpms_client.get_phenometrics_region(self.url, self.cube, timeseries)
+        self.assertEqual([p['point'] for p in phenos], [[i, i] for i in range(3)])
+
+    def test_timeseries_region_many(self):
+        """Test geometries with numpy coordinates on concurrent requests."""
+        geoms = [{'type': 'Point', 'coordinates': np.array([0.0, 0.0])}] * 2
+        self.assertEqual(
+            [len(pixels) for pixels in wcpms_client.run_timeseries_region_many(self.url, self.cube, geoms)],
+            [WCPMSHandler.PIXELS] * 2
+        )
+        self.assertEqual(json.loads(self.server.requests[0][2])['geom'], {'type': 'Point', 'coordinates': [0.0, 0.0]})
+
+
+class CacheTest(WCPMSServerTestCase):
+    """Test the local cache and the in-memory caches of the WCPMS requests."""
+
+    def test_post_body_key(self):
+        """Test POST requests are cached by their body."""
+        geoms = [{'type': 'Point', 'coordinates': [0, 0]}, {'type': 'Point', 'coordinates': [1, 1]}]
+        for geom in geoms + geoms:
+            self.assertEqual(len(wcpms_client.get_timeseries_region(self.url, self.cube, geom)), WCPMSHandler.PIXELS)
+        self.assertEqual([json.loads(body)['geom'] for _, _, body in self.server.requests], geoms)
+
+    def test_catalog_ttl(self):
+        """Test the catalog results are kept in memory for an hour."""
+        self.assertEqual(wcpms_client.get_collections(self.url), ['S2-16D-2'])
+        self.assertEqual(len(wcpms_client._COLLECTIONS_CACHE), 1)
+        wcpms_client._COLLECTIONS_CACHE.expire(wcpms_client._COLLECTIONS_CACHE.timer() + 3599)
+        self.assertEqual(len(wcpms_client._COLLECTIONS_CACHE), 1)
+        wcpms_client._COLLECTIONS_CACHE.expire(wcpms_client._COLLECTIONS_CACHE.timer() + 3600)
+        self.assertEqual(len(wcpms_client._COLLECTIONS_CACHE), 0)
+
+    def test_invalidate_cache(self):
+        """Test invalidate_cache clears the local cache together with the in-memory caches."""
+        def query():
+            wcpms_client.get_phenometrics(self.url, self.cube, -29.2, -55.95)
+            wcpms_client.get_collections(self.url)
+            wcpms_client.get_description(self.url)
+
+        query()
+        query()
+        self.assertEqual(len(self.server.requests), 3)
+        wcpms_client.clear_catalog_cache()
+        query()
+        self.assertEqual(len(self.server.requests), 3)
+        wcpms_client.invalidate_cache()
+        query()
+        self.assertEqual(len(self.server.requests), 6)
+
+
+class PhenometricsBatchTest(WCPMSServerTestCase):
+    """Test the phenometrics of several locations retrieved in a single request."""
+
+    POINTS = [(-29.2, -55.95), (-12.5, -45.0), (-9.0, -60.0)]
+
+    def test_order(self):
+        """Test the results follow the order the locations were added."""
+        with wcpms_client.phenometrics_batch(self.url, self.cube) as batch:
+            indexes = [batch.add(latitude, longitude) for latitude, longitude in self.POINTS]
+        self.assertEqual(indexes, [0, 1, 2])
+        self.assertEqual([p['point'] for p in batch.results], [list(point) for point in self.POINTS])
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_empty(self):
+        """Test an empty batch sends no request."""
+        with wcpms_client.phenometrics_batch(self.url, self.cube) as batch:
+            pass
+        self.assertEqual(batch.results, [])
+        self.assertEqual(self.server.requests, [])
+
+
+class PhenometricsTest(WCPMSServerTestCase):
+    """Test the phenometrics requests of single locations."""
+
+    def test_result_copy(self):
+        """Test changing a result does not change the results of later calls."""
+        pm = wcpms_client.get_phenometrics(self.url, self.cube, -29.2, -55.95)
+        pm['timeseries']['values'].clear()
+        pm = wcpms_client.get_phenometrics(self.url, self.cube, -29.2, -55.95)
+        self.assertEqual(pm['point'], [-29.2, -55.95])
+        self.assertEqual(len(pm['timeseries']['values']), 23)
+        self.assertEqual(len(self.server.requests), 1)
+
+
+class TimeoutTest(WCPMSServerTestCase):
+    """Test the timeouts and retries of the WCPMS requests."""
+
+    def test_default_timeout(self):
+        """Test a slow server raises a connection error, once the read timeouts are retried, with the default timeout."""
+        self.server.delay = 0.5
+        with mock.patch.object(wcpms_client, '_TIMEOUT', (5, 0.1)):
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                wcpms_client.get_collections(self.url)
+
+    def test_timeout_argument(self):
+        """Test a given timeout replaces the default one."""
+        self.server.delay = 0.5
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            wcpms_client._get(self.url + '/list_collections', timeout=(5, 0.1))
+        self.assertEqual(wcpms_client._get(self.url + '/list_collections', timeout=5).status_code, 200)
+
+    def test_retries_exhausted(self):
+        """Test the last gateway error response is returned once the retries are exhausted."""
+        self.server.status = 503
+        self.assertEqual(wcpms_client._get(self.url + '/list_collections').status_code, 503)
+        self.assertEqual(len(self.server.requests), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()